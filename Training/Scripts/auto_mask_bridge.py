@@ -3,27 +3,150 @@ import cv2
 import os
 import numpy as np
 import argparse
+import json
+import math
+import queue
+import threading
+from collections import deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import torch
 
-def process_images(input_dir, output_dir, model_path=None, prompt="concrete bridge"):
+def iter_batches(items, batch_size):
+    """items를 batch_size 크기의 리스트로 나누어 순서대로 반환합니다."""
+    it = iter(items)
+    while True:
+        batch = list(islice(it, batch_size))
+        if not batch:
+            return
+        yield batch
+
+def prefetch_images(files, maxsize=16, workers=4):
+    """별도 스레드에서 이미지를 미리 읽어 (file, img)를 입력 순서대로 반환합니다. 읽기 실패 시 img는 None입니다."""
+    q = queue.Queue(maxsize=maxsize)
+    end = object()
+
+    def producer():
+        pending = deque()
+
+        def put_oldest():
+            file, future = pending.popleft()
+            q.put((file, future.result() if future.exception() is None else None))
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                # 동시에 디코딩 중인 이미지 수를 workers개로 제한
+                for file in files:
+                    pending.append((file, pool.submit(cv2.imread, str(file))))
+                    if len(pending) >= workers:
+                        put_oldest()
+                while pending:
+                    put_oldest()
+        finally:
+            q.put(end)
+
+    threading.Thread(target=producer, daemon=True).start()
+    while True:
+        item = q.get()
+        if item is end:
+            return
+        yield item
+
+def write_calibration_yaml(yaml_path, image_dir, names):
+    """INT8 변환 시 calibration에 사용할 데이터셋 yaml을 작성합니다. (입력 프레임을 그대로 사용)"""
+    lines = [f"path: {json.dumps(str(Path(image_dir).resolve()))}", "train: .", "val: .", "names:"]
+    lines += [f"  {k}: {json.dumps(v)}" for k, v in names.items()]
+    Path(yaml_path).write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return str(yaml_path)
+
+def export_engine(det_model, engine_path, imgsz, batch_size, precision="fp16", calib_data=None, calib_fraction=1.0):
+    """Detection 모델을 TensorRT 엔진으로 변환하고 로드합니다. 이미 변환된 엔진이 있으면 재사용합니다."""
+    if not engine_path.exists():
+        print(f"Exporting detection model to TensorRT: {engine_path.name} (first run only)")
+        export_args = dict(format='engine', imgsz=imgsz, batch=batch_size, dynamic=True, verbose=False)
+        if precision == "int8":
+            export_args.update(int8=True, data=calib_data, fraction=calib_fraction)
+        else:
+            export_args.update(half=(precision == "fp16"))
+        exported = det_model.export(**export_args)
+        os.replace(exported, engine_path)
+    return YOLO(str(engine_path), task='detect')
+
+def load_compile_cache(cache_path):
+    """저장된 TorchInductor 컴파일 결과(Mega-Cache)를 불러옵니다. 첫 forward 이전에 호출해야 합니다."""
+    if cache_path.exists() and hasattr(torch.compiler, "load_cache_artifacts"):
+        print(f"Loading compiled kernels from: {cache_path.name}")
+        torch.compiler.load_cache_artifacts(cache_path.read_bytes())
+
+def save_compile_cache(cache_path):
+    """
+    warmup으로 생성된 TorchInductor 컴파일 결과를 파일로 저장합니다.
+    torch 버전 변경 등으로 캐시가 맞지 않아 새로 컴파일된 경우에도 반영되도록 매번 덮어씁니다.
+    """
+    if not hasattr(torch.compiler, "save_cache_artifacts"):
+        return
+    artifacts = torch.compiler.save_cache_artifacts()
+    if artifacts is not None:
+        cache_path.write_bytes(artifacts[0])
+        print(f"Saved compiled kernels to: {cache_path.name}")
+
+def warmup_models(det_model, seg_model, sample, imgsz, batch_size, half=False):
+    """
+    실제 입력 프레임(sample)으로 한 번씩 추론하여 predictor 생성, 엔진/컴파일 초기화 비용을 루프 밖에서 치릅니다.
+    letterbox 후 입력 크기가 실제 루프와 같아야 컴파일된 커널이 재사용됩니다.
+    """
+    h, w = sample.shape[:2]
+    det_model.predict([sample] * batch_size, imgsz=imgsz, batch=batch_size, half=half, verbose=False)
+    seg_model(sample, bboxes=[[w // 4, h // 4, w * 3 // 4, h * 3 // 4]], half=half, verbose=False)
+
+def compile_models(det_model, seg_model):
+    """
+    predictor가 실제 추론에 사용하는 모듈을 torch.compile로 교체합니다.
+    predictor 생성 시 AutoBackend가 fuse()로 모듈을 새로 만들기 때문에, 그 전에 컴파일하면 적용되지 않습니다.
+    """
+    det_backend = det_model.predictor.model  # AutoBackend
+    det_backend.model = torch.compile(det_backend.model, mode='reduce-overhead', fullgraph=False)
+    # SAM은 프롬프트 개수가 매번 달라 재컴파일되므로 무거운 image encoder만 컴파일
+    sam = seg_model.predictor.model
+    if not hasattr(sam, 'image_encoder'):
+        sam = sam.model  # AutoBackend로 감싼 경우
+    sam.image_encoder = torch.compile(sam.image_encoder, fullgraph=False)
+
+def process_images(input_dir, output_dir, model_path=None, prompt="concrete bridge", batch_size=8,
+                   backend="torch", imgsz=640, precision="fp16"):
 
     # 모델 경로 설정 (Scripts 폴더의 상위 폴더인 Training 아래 Models 폴더 참조)
     script_dir = Path(__file__).resolve().parent
     model_dir = script_dir.parent / "Models"
     sam_path = model_dir / 'sam_b.pt'
 
+    batch_size = max(1, batch_size)
+    # 입력 크기는 모델 stride(32)의 배수여야 함 (Ultralytics와 동일하게 올림)
+    if imgsz % 32:
+        imgsz = math.ceil(imgsz / 32) * 32
+        print(f"--imgsz must be a multiple of 32; using {imgsz}.")
+
     # 1. Detection 모델 로드 (Custom YOLO 또는 YOLO-World)
     if model_path and os.path.exists(model_path):
         print(f"Loading custom model from: {model_path}")
         # .onnx 또는 .pt 파일 로드. task='detect'는 자동으로 추론됨
         det_model = YOLO(model_path)
         # 커스텀 모델은 set_classes가 필요 없음 (학습된 클래스 그대로 사용)
+        det_source = Path(model_path)
+        det_tag = det_source.stem
+        engine_path = det_source.with_name(f"{det_tag}_{imgsz}_b{batch_size}_{precision}.engine")
     else:
         print(f"Initializing YOLO-World... (Prompt: '{prompt}')")
         yolo_path = model_dir / 'yolov8x-worldv2.pt'
         det_model = YOLOWorld(str(yolo_path))
         det_model.set_classes([prompt])
+        # 프롬프트(클래스)가 엔진에 고정되므로 프롬프트별로 엔진 파일을 구분
+        # (최대 배치 크기도 변환 시 고정되므로 파일 이름에 포함)
+        det_source = yolo_path
+        prompt_tag = "".join(c if c.isalnum() else "_" for c in prompt)
+        det_tag = f"{yolo_path.stem}_{prompt_tag}"
+        engine_path = model_dir / f"{det_tag}_{imgsz}_b{batch_size}_{precision}.engine"
 
     # 2. SAM 로드 (박스 기반 정밀 마스킹)
     seg_model = SAM(str(sam_path))
@@ -34,53 +157,124 @@ def process_images(input_dir, output_dir, model_path=None, prompt="concrete brid
     # jpg, png, JPG, PNG 등 대소문자 구분 없이 찾기
     files = sorted([f for f in input_path.iterdir() if f.suffix.lower() in ['.jpg', '.png', '.jpeg']])
 
+    # 3. 추론 백엔드 설정
+    # INT8은 TensorRT 엔진에서만 지원하므로 다른 백엔드에서는 FP16으로 대체
+    if precision == "int8" and backend != "engine":
+        print("INT8 requires --backend engine; falling back to FP16.")
+        precision = "fp16"
+    half = precision == "fp16"
+
+    if backend == "engine":
+        # TensorRT 엔진은 .pt에서만 변환 가능 (.onnx/.engine 모델은 그대로 사용)
+        if det_source.suffix == '.pt':
+            calib_data = None
+            calib_fraction = 1.0
+            if precision == "int8":
+                # 입력 프레임 중 약 200장을 calibration에 사용
+                calib_data = write_calibration_yaml(model_dir / "calib.yaml", input_path, det_model.names)
+                calib_fraction = min(1.0, 200 / max(1, len(files)))
+            det_model = export_engine(det_model, engine_path, imgsz, batch_size, precision, calib_data, calib_fraction)
+        else:
+            print(f"TensorRT export requires a .pt model; using {det_source.name} as is.")
+    elif backend == "compile":
+        # 컴파일 결과를 Models 폴더에 보관하여 다음 실행부터 재컴파일 생략 (모델/프롬프트별로 구분)
+        os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", str(model_dir / "inductor"))
+        compile_cache_path = model_dir / f"inductor_cache_{det_tag}_{imgsz}_b{batch_size}_{precision}.bin"
+        load_compile_cache(compile_cache_path)
+
+    # 첫 프레임을 warmup 입력으로 사용 (실제 입력과 같은 letterbox 크기)
+    sample = cv2.imread(str(files[0])) if files else None
+    if backend != "torch" and sample is not None:
+        warmup_models(det_model, seg_model, sample, imgsz, batch_size, half)
+    if backend == "compile" and sample is not None:
+        print("Compiling models with torch.compile...")
+        compile_models(det_model, seg_model)
+        warmup_models(det_model, seg_model, sample, imgsz, batch_size, half)
+        save_compile_cache(compile_cache_path)
+
     print(f"Found {len(files)} images in {input_dir}")
     print("Starting auto-masking process. This may take a while...")
 
-    for i, file in enumerate(files):
-        try:
-            # A. YOLO-World로 교각 위치(Box) 탐지
-            det_results = det_model.predict(str(file), conf=0.05, verbose=False)
+    skipped = []
+    i = 0
 
-            img = cv2.imread(str(file))
-            if img is None: continue
+    # 이미지 로딩은 별도 스레드에서 미리 수행하여 디스크 I/O와 GPU 추론을 겹침
+    images_iter = prefetch_images(files, maxsize=2 * batch_size, workers=batch_size)
+    for batch in iter_batches(images_iter, batch_size):
+        # 한 번 디코딩한 이미지를 Detection과 SAM에 함께 사용 (파일 재디코딩/전처리 중복 제거)
+        loaded = [(file, img) for file, img in batch if img is not None]
+        i += len(batch) - len(loaded)
+        if not loaded:
+            continue
+        batch = [file for file, _ in loaded]
+        images = [img for _, img in loaded]
 
-            # 탐지된 것이 없으면 검은색(또는 원본) 저장
-            if len(det_results[0].boxes) == 0:
-                print(f"[{i+1}/{len(files)}] No '{prompt}' detected in {file.name}. Saving black image.")
-                black_img = np.zeros_like(img)
-                cv2.imwrite(str(Path(output_dir) / file.name), black_img)
-                continue
+        # A. YOLO-World로 교각 위치(Box) 탐지 (배치 단위로 한 번에 추론)
+        # stream=True로 Results를 하나씩 받아 박스만 CPU로 옮기고 바로 해제합니다.
+        # (stream=False는 GPU 텐서를 가진 Results를 모두 쌓아 두어 메모리가 계속 증가)
+        bboxes_list = []
+        try:
+            for det_result in det_model.predict(images, conf=0.05, imgsz=imgsz, batch=len(images), half=half, verbose=False, stream=True):
+                bboxes_list.append(det_result.boxes.xyxy.cpu().numpy())
+                del det_result
+        except Exception as e:
+            print(f"Error detecting batch starting at {batch[0].name}: {e}")
+            i += len(batch)
+            continue
 
-            # B. 탐지된 박스 좌표 가져오기
-            bboxes = det_results[0].boxes.xyxy.cpu().numpy()
+        for file, bboxes, img in zip(batch, bboxes_list, images):
+            i += 1
+            try:
+                # 탐지된 것이 없으면 저장하지 않고 skipped.txt에 기록 (COLMAP 입력에서 제외)
+                # 검은 이미지는 SfM에 쓸모가 없고 인코딩/디스크 I/O만 낭비합니다.
+                if len(bboxes) == 0:
+                    print(f"[{i}/{len(files)}] No '{prompt}' detected in {file.name}. Skipping.")
+                    # 이전 실행에서 저장된 결과가 남아 있으면 제거
+                    (Path(output_dir) / file.name).unlink(missing_ok=True)
+                    skipped.append(file.name)
+                    continue
 
-            # C. SAM으로 박스 내부의 정밀한 누끼(Mask) 따기
-            # ultralytics SAM은 bboxes 인자를 받아 해당 영역만 세그멘테이션합니다.
-            seg_results = seg_model(str(file), bboxes=bboxes, verbose=False)
+                # B. SAM으로 박스 내부의 정밀한 누끼(Mask) 따기
+                # SAM의 box 프롬프트는 이미지 한 장 기준이므로 SAM은 이미지별로 호출합니다.
+                # 여러 개의 마스크가 나올 수 있으므로 하나로 합치기
+                # 마스크를 GPU에서 한 번의 reduction으로 합치고, 합쳐진 마스크 하나만 CPU로 옮깁니다.
+                h, w = img.shape[:2]
+                combined_mask = np.zeros((h, w), dtype=np.uint8)
+                for seg_result in seg_model(img, bboxes=bboxes, half=half, verbose=False, stream=True):
+                    if seg_result.masks is None:
+                        continue
+                    # (M, h', w') → (h', w'): 각 픽셀을 한 번만 읽는 단일 커널
+                    merged = seg_result.masks.data.any(dim=0)
+                    # 크기가 맞지 않을 경우를 대비해 리사이즈 (보통은 맞음)
+                    # nearest 보간은 OR과 순서를 바꿔도 결과가 같으므로 합친 뒤 한 장만 리사이즈
+                    if merged.shape != (h, w):
+                        merged = torch.nn.functional.interpolate(merged[None, None].float(), size=(h, w), mode='nearest')[0, 0] > 0.5
+                    # 0/1 uint8 마스크를 그대로 곱셈 마스크로 사용
+                    combined_mask |= merged.to(torch.uint8).cpu().numpy()
 
-            # 여러 개의 마스크가 나올 수 있으므로 하나로 합치기
-            combined_mask = np.zeros(img.shape[:2], dtype=bool)
+                # C. 배경 제거 (마스크가 아닌 부분은 검은색 처리)
+                # 3DGS는 검은색 배경을 '빈 공간'으로 인식하기 유리합니다.
+                # boolean 인덱싱 대신 채널 broadcast 곱셈으로 한 번에 처리 (반전 마스크 할당 없음)
+                np.multiply(img, combined_mask[:, :, None], out=img)
 
-            if seg_results[0].masks is not None:
-                for mask in seg_results[0].masks.data:
-                    m = mask.cpu().numpy().astype(bool)
-                    # 크기가 맞지 않을 경우를 대비해 리사이즈 (보통은 맞음)
-                    if m.shape != combined_mask.shape:
-                        m = cv2.resize(m.astype(np.uint8), (combined_mask.shape[1], combined_mask.shape[0])).astype(bool)
-                    combined_mask |= m
+                # 저장
+                output_file = Path(output_dir) / file.name
+                cv2.imwrite(str(output_file), img)
+                print(f"[{i}/{len(files)}] Processed {file.name}")
 
-            # D. 배경 제거 (마스크가 아닌 부분은 검은색 처리)
-            # 3DGS는 검은색 배경을 '빈 공간'으로 인식하기 유리합니다.
-            img[~combined_mask] = [0, 0, 0]
+            except Exception as e:
+                print(f"Error processing {file.name}: {e}")
 
-            # 저장
-            output_file = Path(output_dir) / file.name
-            cv2.imwrite(str(output_file), img)
-            print(f"[{i+1}/{len(files)}] Processed {file.name}")
+        # 배치 경계마다 캐시된 GPU 메모리를 반환해 피크 VRAM을 일정하게 유지
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
 
-        except Exception as e:
-            print(f"Error processing {file.name}: {e}")
+    skipped_path = Path(output_dir) / "skipped.txt"
+    if skipped:
+        skipped_path.write_text("\n".join(skipped) + "\n", encoding="utf-8")
+        print(f"\n{len(skipped)} images without detections are listed in: {skipped_path}")
+    else:
+        skipped_path.unlink(missing_ok=True)
 
     print(f"\nDone! Masked images are saved in: {output_dir}")
 
@@ -90,6 +284,13 @@ if __name__ == "__main__":
     parser.add_argument('--output', type=str, required=True, help='Path to save masked images')
     parser.add_argument('--model', type=str, default=None, help='Path to custom YOLO model (.onnx or .pt). If not provided, uses YOLO-World.')
     parser.add_argument('--prompt', type=str, default='concrete bridge', help='Text prompt for YOLO-World (ignored if custom model is used)')
+    parser.add_argument('--batch', type=int, default=8, help='Number of images per detection batch (default: 8)')
+    parser.add_argument('--backend', type=str, default='torch', choices=['torch', 'compile', 'engine'],
+                        help='Inference backend: eager PyTorch, torch.compile, or TensorRT engine for detection (default: torch)')
+    parser.add_argument('--imgsz', type=int, default=640, help='Detection input size (default: 640)')
+    parser.add_argument('--precision', type=str, default='fp16', choices=['fp32', 'fp16', 'int8'],
+                        help='Inference precision. int8 requires --backend engine and calibrates on the input images (default: fp16)')
 
     args = parser.parse_args()
-    process_images(args.input, args.output, args.model, args.prompt)
+    process_images(args.input, args.output, args.model, args.prompt, args.batch,
+                   args.backend, args.imgsz, args.precision)
@@ -6,9 +6,75 @@
 import os
 import sys
 import argparse
+import threading
 import cv2
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+try:
+    # 선택 의존성: 큰 폭으로 축소 추출할 때 색 변환과 리사이즈를 swscale 한 번으로 처리
+    import av
+except ImportError:
+    av = None
+
+
+def iter_frames_cv2(cap, frame_interval: int, resize_size: tuple = None):
+    """OpenCV로 frame_interval마다 한 장씩 BGR 프레임을 반환합니다."""
+    frame_idx = 0
+    while True:
+        # grab()은 디코딩만 수행하고, BGR 변환/복사는 저장할 프레임에서만 retrieve()로 수행
+        if not cap.grab():
+            return
+        
+        if frame_idx % frame_interval == 0:
+            ret, frame = cap.retrieve()
+            if not ret:
+                return
+            
+            # 리사이즈
+            if resize_size:
+                frame = cv2.resize(frame, resize_size)
+            yield frame
+        
+        frame_idx += 1
+
+
+def pyav_frame_size(video_path: str):
+    """
+    PyAV가 출력할 프레임 크기 (width, height)를 반환합니다.
+    PyAV는 회전 메타데이터를 적용하지 않으므로, 회전된 동영상이거나 열 수 없으면 None을 반환합니다.
+    """
+    try:
+        with av.open(video_path) as container:
+            stream = container.streams.video[0]
+            rotation = int(float(stream.metadata.get("rotate", 0) or 0))
+            # 최신 FFmpeg는 회전 정보를 display matrix로 저장 (PyAV 13 이상은 frame.rotation으로 제공)
+            frame = next(container.decode(stream), None)
+            if frame is not None:
+                rotation = rotation or int(getattr(frame, "rotation", 0) or 0)
+            if rotation % 360:
+                return None
+            return stream.width, stream.height
+    except Exception:
+        return None
+
+
+def iter_frames_pyav(video_path: str, frame_interval: int, resize_size: tuple):
+    """
+    PyAV로 frame_interval마다 한 장씩 BGR 프레임을 반환합니다.
+    YUV → BGR 변환과 축소를 swscale에서 한 번에 출력 해상도로 수행하므로,
+    원본 해상도의 BGR 프레임을 만든 뒤 cv2.resize 하는 것보다 메모리 트래픽이 적습니다.
+    """
+    container = av.open(video_path)
+    try:
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+        for frame_idx, frame in enumerate(container.decode(stream)):
+            if frame_idx % frame_interval == 0:
+                yield frame.to_ndarray(width=resize_size[0], height=resize_size[1], format="bgr24")
+    finally:
+        container.close()
+
 
 def extract_frames(
     video_path: str,
@@ -32,9 +98,15 @@ def extract_frames(
     output_path = Path(output_dir)
     images_path = output_path / "input"
     images_path.mkdir(parents=True, exist_ok=True)
-    
-    # 동영상 열기
-    cap = cv2.VideoCapture(video_path)
+    # 프레임 이름은 순번(frame_%05d)이므로 이전 마스킹 결과의 제외 목록은 새 프레임과 맞지 않음
+    (images_path / "skipped.txt").unlink(missing_ok=True)
+
+    # 동영상 열기 (하드웨어 디코더를 사용할 수 있으면 사용, 없으면 소프트웨어 디코딩)
+    # 하드웨어 디코딩은 --resize-width와 무관하게 디코딩 자체의 CPU 부하를 줄임
+    cap = cv2.VideoCapture(
+        video_path, cv2.CAP_ANY,
+        [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY]
+    )
     if not cap.isOpened():
         print(f"오류: 동영상을 열 수 없습니다 - {video_path}")
         sys.exit(1)
@@ -58,38 +130,73 @@ def extract_frames(
     print(f"  - 예상 추출 프레임: {expected_frames}")
     print()
     
+    # 리사이즈 크기는 모든 프레임이 동일하므로 미리 계산
+    resize_size = None
+    if resize_width:
+        aspect_ratio = height / width
+        resize_size = (resize_width, int(resize_width * aspect_ratio))
+    
+    # H.264/HEVC 디코더는 축소 디코딩(IDCT 생략)을 지원하지 않아 디코딩은 항상 원본 해상도로 수행됨.
+    # 1/2 이하로 축소할 때는 PyAV(설치된 경우)로 색 변환과 축소를 출력 해상도에서 한 번에 처리
+    # OpenCV는 회전 메타데이터를 자동 적용하므로, PyAV 프레임이 OpenCV와 같은 방향/크기일 때만 사용
+    if (resize_size and resize_width < width / 2 and av is not None
+            and pyav_frame_size(video_path) == (width, height)):
+        cap.release()
+        frames = iter_frames_pyav(video_path, frame_interval, resize_size)
+    else:
+        frames = iter_frames_cv2(cap, frame_interval, resize_size)
+    
+    # JPEG 인코딩/저장은 스레드 풀에서 다음 프레임 디코딩과 병렬로 수행
+    # (cv2.imwrite는 인코딩 중 GIL을 해제함)
+    workers = max(1, (os.cpu_count() or 2) // 2)
+    # 대기 중인 저장 작업 수를 제한하여 메모리 사용량 제한
+    pending = threading.BoundedSemaphore(2 * workers)
+    failed = []
+    futures = []
+    
+    def write_frame(filepath, frame):
+        try:
+            if not cv2.imwrite(str(filepath), frame, [cv2.IMWRITE_JPEG_QUALITY, 95]):
+                failed.append(filepath.name)
+        finally:
+            pending.release()
+    
     # 프레임 추출
-    frame_idx = 0
     saved_count = 0
     
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        
-        if frame_idx % frame_interval == 0:
-            # 리사이즈
-            if resize_width:
-                aspect_ratio = height / width
-                new_height = int(resize_width * aspect_ratio)
-                frame = cv2.resize(frame, (resize_width, new_height))
-            
-            # 저장
-            filename = f"frame_{saved_count:05d}.jpg"
-            filepath = images_path / filename
-            cv2.imwrite(str(filepath), frame, [cv2.IMWRITE_JPEG_QUALITY, 95])
-            
-            saved_count += 1
-            
-            if saved_count % 10 == 0:
-                print(f"  추출 진행: {saved_count}/{expected_frames}")
-            
-            if max_frames and saved_count >= max_frames:
-                break
-        
-        frame_idx += 1
+    try:
+        # with 블록을 벗어나면(예외 포함) 남은 저장 작업이 모두 끝날 때까지 대기
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for frame in frames:
+                # 저장
+                filename = f"frame_{saved_count:05d}.jpg"
+                filepath = images_path / filename
+                pending.acquire()
+                futures.append((filename, pool.submit(write_frame, filepath, frame)))
+                
+                saved_count += 1
+                
+                if saved_count % 10 == 0:
+                    print(f"  추출 진행: {saved_count}/{expected_frames}")
+                
+                if max_frames and saved_count >= max_frames:
+                    break
+    finally:
+        frames.close()
+        cap.release()
     
-    cap.release()
+    # 저장 스레드에서 발생한 예외(디스크 부족, 경로 오류 등) 확인
+    errors = [(filename, future.exception()) for filename, future in futures if future.exception() is not None]
+    if errors:
+        print(f"오류: {len(errors)}장의 이미지 저장 중 예외 발생")
+        for filename, error in errors[:5]:
+            print(f"  - {filename}: {error}")
+        sys.exit(1)
+    
+    # cv2.imwrite는 쓰기 실패 시 예외 대신 False를 반환하므로 예외와 동일하게 실패 처리
+    if failed:
+        print(f"오류: {len(failed)}장의 이미지 저장 실패 - {', '.join(failed[:5])}")
+        sys.exit(1)
     
     print()
     print(f"프레임 추출 완료!")
@@ -6,7 +6,10 @@ COLMAP을 사용하여 이미지에서 카메라 파라미터를 추출하는 
 import os
 import sys
 import argparse
+import json
+import sqlite3
 import subprocess
+from functools import lru_cache
 from pathlib import Path
 
 
@@ -25,11 +28,61 @@ def run_command(cmd: list, desc: str = ""):
     return True
 
 
+@lru_cache(maxsize=None)
+def colmap_help(colmap_path: str, command: str) -> str:
+    """COLMAP 명령어의 도움말(-h) 출력을 반환합니다."""
+    try:
+        result = subprocess.run([colmap_path, command, "-h"], capture_output=True, text=True)
+    except OSError:
+        return ""
+    return result.stdout + result.stderr
+
+
+def colmap_option(colmap_path: str, command: str, name: str, groups: list) -> str:
+    """
+    COLMAP 버전에 따라 옵션 그룹 이름이 다른 옵션을 찾습니다.
+    (예: 구버전은 --SiftExtraction.use_gpu, 최신 버전은 --FeatureExtraction.use_gpu)
+    도움말에서 찾지 못하면 마지막 그룹 이름을 사용합니다.
+    """
+    help_text = colmap_help(colmap_path, command)
+    for group in groups:
+        option = f"--{group}.{name}"
+        if option in help_text:
+            return option
+    return f"--{groups[-1]}.{name}"
+
+
+def database_images(database_path: Path) -> dict:
+    """COLMAP database에 이미 등록된 이미지 이름과 카메라 ID를 반환합니다. (database가 없으면 빈 dict)"""
+    if not database_path.exists():
+        return {}
+    try:
+        with sqlite3.connect(str(database_path)) as conn:
+            return dict(conn.execute("SELECT name, camera_id FROM images").fetchall())
+    except sqlite3.Error:
+        return {}
+
+
+def load_database_settings(settings_path: Path) -> dict:
+    """database 생성 시 사용한 특징점 추출 설정을 읽습니다. (없거나 읽을 수 없으면 None)"""
+    try:
+        return json.loads(settings_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
 def run_colmap_preprocessing(
     data_dir: str,
     colmap_path: str = "colmap",
     use_gpu: bool = True,
-    camera_model: str = "SIMPLE_RADIAL"
+    camera_model: str = "SIMPLE_RADIAL",
+    matcher: str = "sequential",
+    vocab_tree_path: str = None,
+    sequential_overlap: int = 10,
+    gpu_index: str = None,
+    max_image_size: int = 2000,
+    num_threads: int = None,
+    undistort_max_image_size: int = None
 ):
     """
     COLMAP을 사용하여 SfM(Structure from Motion) 처리를 수행합니다.
@@ -39,6 +92,13 @@ def run_colmap_preprocessing(
         colmap_path: COLMAP 실행 파일 경로
         use_gpu: GPU 사용 여부
         camera_model: 카메라 모델 (OPENCV, PINHOLE 등)
+        matcher: 매칭 방식 (sequential: 연속 프레임, exhaustive: 전체 쌍, vocab_tree: 대규모 데이터)
+        vocab_tree_path: Vocabulary tree 파일 경로 (vocab_tree 매칭 및 sequential 루프 검출에 사용)
+        sequential_overlap: sequential 매칭 시 각 이미지와 매칭할 다음 프레임 수
+        gpu_index: 사용할 GPU 번호 (예: "0" 또는 "0,1", None이면 COLMAP 기본값)
+        max_image_size: 특징점 추출 시 이미지 최대 크기 (4K 프레임의 연산량 제한)
+        num_threads: 특징점 추출 스레드 수 (None이면 CPU 코어 수)
+        undistort_max_image_size: 왜곡 보정 이미지의 최대 크기 (None이면 원본 크기 유지)
     """
 
     data_path = Path(data_dir)
@@ -59,12 +119,61 @@ def run_colmap_preprocessing(
 
     # 이미지 수 확인
     image_files = list(images_path.glob("*.jpg")) + list(images_path.glob("*.png"))
-    print(f"발견된 이미지: {len(image_files)}장")
+    total_count = len(image_files)
+    print(f"발견된 이미지: {total_count}장")
+
+    # auto_mask_bridge에서 대상이 검출되지 않은 프레임(skipped.txt)은 특징점 추출에서 제외
+    skipped_list_path = images_path / "skipped.txt"
+    if skipped_list_path.exists():
+        skipped = set(skipped_list_path.read_text(encoding="utf-8").splitlines())
+        image_files = [f for f in image_files if f.name not in skipped]
+        print(f"제외된 이미지 (검출 없음): {len(skipped)}장 → 사용할 이미지: {len(image_files)}장")
+
+    # database의 특징점이 어떤 설정으로 추출되었는지 함께 저장 (설정이 바뀌면 재사용 불가)
+    settings_path = data_path / "distorted" / "database_settings.json"
+    extraction_settings = {
+        "camera_model": camera_model,
+        "single_camera": True,
+        "max_image_size": max_image_size,
+        "use_gpu": use_gpu
+    }
+
+    # 이전 실행의 database가 있으면 새로 추가된 이미지만 특징점 추출
+    existing = database_images(database_path)
+    if existing:
+        # 추출 설정(카메라 모델, 이미지 크기, GPU 여부)이 달라졌거나 기록이 없으면 database를 새로 생성
+        settings_changed = load_database_settings(settings_path) != extraction_settings
+        # 등록된 이미지가 database보다 나중에 수정되었거나(프레임 재추출 등) 더 이상 사용되지 않으면
+        # database를 새로 생성
+        db_mtime = database_path.stat().st_mtime
+        modified = any(f.name in existing and f.stat().st_mtime > db_mtime for f in image_files)
+        removed = not set(existing) <= {f.name for f in image_files}
+        if settings_changed:
+            print("특징점 추출 설정이 변경되어 database를 새로 생성합니다.")
+        elif modified or removed:
+            print("이미지가 변경되어 database를 새로 생성합니다.")
+        if settings_changed or modified or removed:
+            database_path.unlink()
+            existing = {}
+    new_files = [f for f in image_files if f.name not in existing]
+    if existing:
+        print(f"database에 등록된 이미지: {len(existing)}장 → 새로 추출할 이미지: {len(new_files)}장")
+
+    # 일부 이미지만 추출하는 경우 image_list로 대상 지정
+    image_list_path = None
+    if len(new_files) != total_count:
+        image_list_path = data_path / "distorted" / "image_list.txt"
+        image_list_path.write_text("\n".join(sorted(f.name for f in new_files)) + "\n", encoding="utf-8")
 
     if len(image_files) < 10:
         print("경고: 이미지가 너무 적습니다. 최소 50장 이상을 권장합니다.")
 
     gpu_flag = "1" if use_gpu else "0"
+    if num_threads is None:
+        num_threads = os.cpu_count() or 1
+
+    extraction_groups = ["FeatureExtraction", "SiftExtraction"]
+    matching_groups = ["FeatureMatching", "SiftMatching"]
 
     # Step 1: Feature Extraction
     print("\n" + "=" * 60)
@@ -77,22 +186,65 @@ def run_colmap_preprocessing(
         "--image_path", str(images_path),
         "--ImageReader.single_camera", "1",
         "--ImageReader.camera_model", camera_model,
-        # "--SiftExtraction.use_gpu", gpu_flag
+        colmap_option(colmap_path, "feature_extractor", "use_gpu", extraction_groups), gpu_flag,
+        colmap_option(colmap_path, "feature_extractor", "max_image_size", extraction_groups), str(max_image_size),
+        colmap_option(colmap_path, "feature_extractor", "num_threads", extraction_groups), str(num_threads),
+        # affine shape 추정은 CPU 전용이며 동영상 프레임에서는 거의 필요 없음
+        "--SiftExtraction.estimate_affine_shape", "0"
     ]
-
-    if not run_command(cmd_feature, "특징점 추출"):
+    if image_list_path:
+        cmd_feature += ["--image_list_path", str(image_list_path)]
+    if use_gpu and gpu_index:
+        cmd_feature += [colmap_option(colmap_path, "feature_extractor", "gpu_index", extraction_groups), gpu_index]
+
+    if existing:
+        # 추가되는 이미지도 기존 이미지와 같은 카메라를 사용 (single_camera 유지)
+        cmd_feature += ["--ImageReader.existing_camera_id", str(next(iter(existing.values())))]
+
+    if not new_files:
+        print("새로 추가된 이미지가 없습니다. 특징점 추출을 건너뜁니다.")
+    elif not run_command(cmd_feature, "특징점 추출"):
         sys.exit(1)
+    settings_path.write_text(json.dumps(extraction_settings, indent=2) + "\n", encoding="utf-8")
 
     # Step 2: Feature Matching
+    # COLMAP 매처는 database에 매칭 결과가 있는 이미지 쌍을 건너뛰므로 재실행 시 새 쌍만 매칭됨
     print("\n" + "=" * 60)
     print("Step 2/4: 특징점 매칭 (Feature Matching)")
     print("=" * 60)
 
-    cmd_matcher = [
-        colmap_path, "exhaustive_matcher",
-        "--database_path", str(database_path)
-        # "--SiftMatching.use_gpu", gpu_flag
-    ]
+    # 동영상 프레임은 시간 순서대로 정렬되어 있으므로 인접 프레임끼리만 매칭 (exhaustive는 O(N²))
+    if matcher == "sequential":
+        cmd_matcher = [
+            colmap_path, "sequential_matcher",
+            "--database_path", str(database_path),
+            "--SequentialMatching.overlap", str(sequential_overlap)
+        ]
+        # 루프 검출(같은 장소 재방문)은 vocabulary tree가 있을 때만 가능
+        if vocab_tree_path:
+            cmd_matcher += [
+                "--SequentialMatching.loop_detection", "1",
+                "--SequentialMatching.vocab_tree_path", str(vocab_tree_path)
+            ]
+    elif matcher == "vocab_tree":
+        if not vocab_tree_path:
+            print("오류: vocab_tree 매칭에는 --vocab-tree-path가 필요합니다.")
+            sys.exit(1)
+        cmd_matcher = [
+            colmap_path, "vocab_tree_matcher",
+            "--database_path", str(database_path),
+            "--VocabTreeMatching.vocab_tree_path", str(vocab_tree_path)
+        ]
+    else:
+        cmd_matcher = [
+            colmap_path, "exhaustive_matcher",
+            "--database_path", str(database_path)
+        ]
+
+    matcher_command = cmd_matcher[1]
+    cmd_matcher += [colmap_option(colmap_path, matcher_command, "use_gpu", matching_groups), gpu_flag]
+    if use_gpu and gpu_index:
+        cmd_matcher += [colmap_option(colmap_path, matcher_command, "gpu_index", matching_groups), gpu_index]
 
     if not run_command(cmd_matcher, "특징점 매칭"):
         sys.exit(1)
@@ -137,6 +289,9 @@ def run_colmap_preprocessing(
         "--output_path", str(data_path),
         "--output_type", "COLMAP"
     ]
+    # 보정 단계에서 미리 축소하면 이후 학습 단계의 이미지 로딩/연산량도 함께 줄어듦
+    if undistort_max_image_size:
+        cmd_undistort += ["--max_image_size", str(undistort_max_image_size)]
 
     if not run_command(cmd_undistort, "이미지 왜곡 보정"):
         sys.exit(1)
@@ -187,6 +342,30 @@ def main():
         action="store_true",
         help="GPU 사용 안 함"
     )
+    parser.add_argument(
+        "--gpu-index",
+        type=str,
+        default=None,
+        help="사용할 GPU 번호 (예: 0 또는 0,1, 기본값: COLMAP 자동 선택)"
+    )
+    parser.add_argument(
+        "--max-image-size",
+        type=int,
+        default=2000,
+        help="특징점 추출 시 이미지 최대 크기 (기본값: 2000)"
+    )
+    parser.add_argument(
+        "--num-threads",
+        type=int,
+        default=None,
+        help="특징점 추출 스레드 수 (기본값: CPU 코어 수)"
+    )
+    parser.add_argument(
+        "--undistort-max-size",
+        type=int,
+        default=None,
+        help="왜곡 보정 이미지의 최대 크기 (기본값: 원본 크기 유지)"
+    )
     parser.add_argument(
         "--camera-model",
         type=str,
@@ -194,6 +373,25 @@ def main():
         choices=["SIMPLE_RADIAL", "PINHOLE", "OPENCV", "RADIAL"],
         help="카메라 모델 (기본값: SIMPLE_RADIAL - 가장 안정적)"
     )
+    parser.add_argument(
+        "--matcher",
+        type=str,
+        default="sequential",
+        choices=["sequential", "exhaustive", "vocab_tree"],
+        help="특징점 매칭 방식 (기본값: sequential - 동영상 프레임에 적합)"
+    )
+    parser.add_argument(
+        "--vocab-tree-path",
+        type=str,
+        default=None,
+        help="Vocabulary tree 파일 경로 (vocab_tree 매칭 / sequential 루프 검출용)"
+    )
+    parser.add_argument(
+        "--overlap",
+        type=int,
+        default=10,
+        help="sequential 매칭 시 매칭할 인접 프레임 수 (기본값: 10)"
+    )
 
     args = parser.parse_args()
 
@@ -205,7 +403,14 @@ def main():
         data_dir=args.data,
         colmap_path=args.colmap_path,
         use_gpu=not args.no_gpu,
-        camera_model=args.camera_model
+        camera_model=args.camera_model,
+        matcher=args.matcher,
+        vocab_tree_path=args.vocab_tree_path,
+        sequential_overlap=args.overlap,
+        gpu_index=args.gpu_index,
+        max_image_size=args.max_image_size,
+        num_threads=args.num_threads,
+        undistort_max_image_size=args.undistort_max_size
     )
 
 
@@ -49,12 +49,44 @@ def main():
         default=30000,
         help="학습 반복 횟수 (기본값: 30000)"
     )
+    parser.add_argument(
+        "--train-resolution",
+        type=int,
+        default=2,
+        help="학습 이미지 해상도 다운스케일 팩터 (-1: 원본, 2: 1/2, 4: 1/4, 기본값: 2)"
+    )
+    parser.add_argument(
+        "--sh-degree",
+        type=int,
+        default=3,
+        help="Spherical Harmonics 차수 (0-3, 기본값: 3)"
+    )
+    parser.add_argument(
+        "--undistort-max-size",
+        type=int,
+        default=None,
+        help="COLMAP 왜곡 보정 이미지의 최대 크기 (기본값: 원본 크기 유지). "
+             "지정하면 --train-resolution은 축소된 이미지 기준으로 다시 적용되므로 함께 -1로 설정하세요"
+    )
     parser.add_argument(
         "--colmap-path",
         type=str,
         default="colmap",
         help="COLMAP 실행 파일 경로"
     )
+    parser.add_argument(
+        "--matcher",
+        type=str,
+        default="sequential",
+        choices=["sequential", "exhaustive", "vocab_tree"],
+        help="COLMAP 특징점 매칭 방식 (기본값: sequential)"
+    )
+    parser.add_argument(
+        "--vocab-tree-path",
+        type=str,
+        default=None,
+        help="COLMAP vocabulary tree 파일 경로 (vocab_tree 매칭 / 루프 검출용)"
+    )
     parser.add_argument(
         "--gs-path",
         type=str,
@@ -117,7 +149,10 @@ def main():
         run_colmap_preprocessing(
             data_dir=str(output_path),
             colmap_path=args.colmap_path,
-            use_gpu=True
+            use_gpu=True,
+            matcher=args.matcher,
+            vocab_tree_path=args.vocab_tree_path,
+            undistort_max_image_size=args.undistort_max_size
         )
     else:
         print("\nCOLMAP 전처리 건너뛰기...")
@@ -141,7 +176,9 @@ def main():
         run_training(
             source_path=str(output_path),
             gs_path=str(gs_path),
-            iterations=args.iterations
+            iterations=args.iterations,
+            resolution=args.train_resolution,
+            sh_degree=args.sh_degree
         )
     else:
         print("\n학습 건너뛰기...")